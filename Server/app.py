@@ -1,10 +1,14 @@
 # app.py
 from flask import Flask, request, jsonify
 from fsbi import FSBIIndex
+from serving import RWLock, QueryBatcher
 import os
 
 app = Flask(__name__)
 INDEX = FSBIIndex(m_bits=2048, k_lex=2, k_sem=2)
+# queries share the index under a read lock and are batched; indexing takes the write lock
+INDEX_LOCK = RWLock()
+BATCHER = QueryBatcher(INDEX, INDEX_LOCK)
 
 @app.route("/health", methods=["GET"])
 def health():
@@ -16,28 +20,35 @@ def index_doc():
     doc_id = payload["doc_id"]
     text = payload["text"]
     meta = payload.get("meta", {})
-    INDEX.index_document(doc_id, text, metadata=meta)
+    with INDEX_LOCK.write():
+        INDEX.index_document(doc_id, text, metadata=meta)
     return jsonify({"status": "indexed", "doc_id": doc_id})
 
 @app.route("/query", methods=["POST"])
 def query():
     payload = request.get_json(force=True)
     q = payload.get("q", "")
+    if not isinstance(q, str):
+        return jsonify({"error": "q must be a string"}), 400
     top_k = int(payload.get("top_k", 10))
-    results = INDEX.query(q, top_k=top_k)
+    results = BATCHER.submit(q, top_k=top_k)
     # expand results with small metadata snippet
     out = []
-    for doc_id, score in results:
-        doc = INDEX.get_doc(doc_id)
-        snippet = doc.get("text", "")[:200]
-        out.append({"doc_id": doc_id, "score": score, "snippet": snippet})
+    with INDEX_LOCK.read():
+        for doc_id, score in results:
+            doc = INDEX.get_doc(doc_id)
+            snippet = doc.get("text", "")[:200]
+            out.append({"doc_id": doc_id, "score": score, "snippet": snippet})
     return jsonify({"results": out})
 
 @app.route("/snapshot", methods=["GET"])
 def snapshot():
-    snap = INDEX.export_index_snapshot()
+    with INDEX_LOCK.read():
+        snap = INDEX.export_index_snapshot()
     return jsonify({"snapshot": snap})
 
 if __name__ == "__main__":
-    # simple host for dev
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
+    # simple host for dev; production: gunicorn -w 1 --threads 16 -b 0.0.0.0:5000 app:app
+    # (one worker process: the index lives in process memory)
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)),
+            debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
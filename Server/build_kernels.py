@@ -0,0 +1,25 @@
+# build_kernels.py
+# Ahead-of-time compile the hashing and scan kernels into fsbi_kernels.<ext> next to this file:
+#   python build_kernels.py
+# kernels.py picks the compiled module up when its kernel_version() matches KERNEL_VERSION.
+# pycc cannot compile parallel=True (prange) code, so these are serial builds: they cover
+# every call while the parallel JIT kernels compile in the background after startup, and
+# small per-query hash batches after that.
+import os
+from numba.pycc import CC
+import kernels
+
+cc = CC('fsbi_kernels')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+cc.target_cpu = 'host'  # build on the serving machine: enables its SIMD/POPCNT extensions
+
+cc.export('compute_indices', 'i8[:,:](u1[:], i8[:], i8, i8, i8, i8, f4[:,:])')(kernels.compute_indices.py_func)
+cc.export('scan', 'i8[:](u8[:,:], u8[:])')(kernels.scan.py_func)
+cc.export('scan_batch', 'i8[:,:](u8[:,:], u8[:,:])')(kernels.scan_batch.py_func)
+
+@cc.export('kernel_version', 'i8()')
+def kernel_version():
+    return kernels.KERNEL_VERSION
+
+if __name__ == "__main__":
+    cc.compile()
@@ -3,10 +3,18 @@ import os
 import json
 import random
 import math
-import hashlib
+import struct
+import base64
+import functools
+import threading
+from collections import OrderedDict
+import mmh3
 import numpy as np
 from bitarray import bitarray
-from typing import List, Dict, Any, Tuple
+from pyroaring import BitMap, FrozenBitMap
+from typing import List, Dict, Any, Tuple, Union
+from kernels import (compute_indices, compute_indices_serial, jit_ready, pack_subseqs, scan, scan_batch,
+                     scan_serial, scan_batch_serial, FNV_OFFSET, FNV_PRIME)
 
 # Configuration constants
 DEFAULT_M = 2048  # bits per Bloom filter node (tuneable)
@@ -14,11 +22,93 @@ DEFAULT_K_LEX = 2  # number of lexical hashes
 DEFAULT_K_SEM = 2  # number of semantic hash functions (from projection)
 DEFAULT_R = 64  # random projection dimension
 DIFF_PRIV_FLIP_PROB = 0.01  # optional differential privacy bit flip prob
+MAX_K_SEM = 16  # semantic projections precomputed by SemanticProjector
+HASH_CACHE_SIZE = 100_000  # subsequences whose bit indexes are memoized per index
+BLOCK_BITS = 512  # blocked Bloom layout: one 64-byte cache line per subsequence
+PARALLEL_HASH_MIN_SUBSEQS = 64  # batch size from which hashing uses the parallel kernel
+PARALLEL_SCAN_MIN_DOCS = 4096  # corpus size from which the root scan runs multi-threaded
+FSBI_DEBUG = os.environ.get("FSBI_DEBUG") == "1"  # extra invariant checks on hot paths
+SPARSE_EXPORT_DIV = 32  # snapshot nodes with <= m / 32 set bits export as positions
 
-def murmur_hash32(s: str, seed: int = 0) -> int:
-    # Use sha256 as deterministic substitute (fast enough for prototype)
-    h = hashlib.sha256((str(seed) + s).encode('utf-8')).hexdigest()
-    return int(h[:8], 16)
+# numpy>=2.0 ships a POPCNT-backed ufunc; older versions fall back to a byte LUT
+_HAS_BITWISE_COUNT = hasattr(np, "bitwise_count")
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def murmur_hash32(s, seed: int = 0) -> int:
+    # 32-bit MurmurHash3 (C implementation); accepts str or pre-encoded bytes
+    return mmh3.hash(s, seed, signed=False)
+
+def popcount(words: np.ndarray) -> int:
+    # Number of set bits in a packed uint64 word buffer
+    if _HAS_BITWISE_COUNT:
+        return int(np.bitwise_count(words).sum())
+    return int(_BYTE_POPCOUNT[words.view(np.uint8)].sum())
+
+def popcount_and(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # popcount(a & b) summed over the last word axis, so a 2-D stack of nodes
+    # yields one count per row without a Python-level loop
+    both = np.bitwise_and(a, b)
+    if _HAS_BITWISE_COUNT:
+        counts = np.bitwise_count(both)
+    else:
+        counts = _BYTE_POPCOUNT[both.view(np.uint8)]
+    return counts.sum(axis=-1, dtype=np.int64)
+
+def index_mask(idxs: List[int], m: int) -> np.ndarray:
+    # Pack bit indexes into an m-bit uint64 word mask (bit i -> words[i >> 6]).
+    # idxs must already be reduced to [0, m): every hash path emits them that way
+    mask = np.zeros((m + 63) >> 6, dtype=np.uint64)
+    if len(idxs) == 0:
+        return mask
+    i = np.asarray(idxs, dtype=np.uint64)
+    if FSBI_DEBUG:
+        assert (i < m).all(), "bit index out of range"
+    np.bitwise_or.at(mask, (i >> np.uint64(6)).astype(np.intp), np.uint64(1) << (i & np.uint64(63)))
+    return mask
+
+@functools.lru_cache(maxsize=HASH_CACHE_SIZE)
+def query_mask(idxs: Tuple[int, ...], m: int) -> Tuple[np.ndarray, np.ndarray, int, FrozenBitMap]:
+    # Compacted mask for one subsequence: (word positions, mask words, bit count, bitmap).
+    # Cached per idxs tuple, so the returned arrays are read-only
+    mask = index_mask(idxs, m)
+    w = np.flatnonzero(mask)
+    words = mask[w]
+    w.setflags(write=False)
+    words.setflags(write=False)
+    return w, words, popcount(words), FrozenBitMap(int(i) for i in idxs)
+
+def block_indexes(rows: np.ndarray, m: int) -> np.ndarray:
+    # Confine each row's k bits to one BLOCK_BITS block: the first hash picks the
+    # block (low part) and its own in-block bit (high part), the rest pick in-block bits
+    block_bits = min(BLOCK_BITS, m)
+    nblocks = m // block_bits
+    offs = rows % block_bits
+    offs[:, 0] = (rows[:, 0] // nblocks) % block_bits
+    return (rows[:, :1] % nblocks) * block_bits + offs
+
+def flip_mask(m: int, flip_prob: float) -> np.ndarray:
+    # m-bit word mask with each bit set independently with probability flip_prob;
+    # sampled as geometric gaps between set bits (~m * flip_prob draws instead of m)
+    n = int(m * flip_prob + 4 * math.sqrt(m * flip_prob)) + 16
+    pos = np.cumsum(np.random.geometric(flip_prob, size=n)) - 1
+    while pos[-1] < m:
+        pos = np.concatenate([pos, pos[-1] + np.cumsum(np.random.geometric(flip_prob, size=n))])
+    return index_mask(pos[pos < m], m)
+
+def words_to_bits(words: np.ndarray, m: int) -> bitarray:
+    # bitarray copy of packed words (little-endian bit order matches words[i >> 6] >> (i & 63))
+    b = bitarray(endian="little")
+    b.frombytes(words.astype("<u8").tobytes())
+    return b[:m]
+
+def encode_words(words: np.ndarray, m: int) -> Dict[str, Any]:
+    # Snapshot encoding: sparse nodes as set-bit positions (roaring-style array
+    # container), dense ones as base64 of the little-endian word bytes
+    raw = words.astype("<u8")
+    if popcount(raw) <= m // SPARSE_EXPORT_DIV:
+        bits = np.unpackbits(raw.view(np.uint8), bitorder="little")
+        return {"pos": np.flatnonzero(bits[:m]).tolist()}
+    return {"b64": base64.b64encode(raw.tobytes()).decode("ascii")}
 
 class SemanticProjector:
     """
@@ -32,19 +122,33 @@ class SemanticProjector:
         # Random projection matrix p x r where p = number of n-grams considered.
         # For prototype, we'll compute projection on the fly using char ngrams hashing.
         self._seed = seed
+        # (MAX_K_SEM, r) float32 signed projections used by semantic_hashes, drawn once
+        self.proj_matrix = self._build_proj_matrix(MAX_K_SEM)
+
+    def _build_proj_matrix(self, k: int) -> np.ndarray:
+        rng = np.random.default_rng(self._seed)
+        return rng.standard_normal((k, self.r), dtype=np.float32)
+
+    def projection_matrix(self, k: int) -> np.ndarray:
+        # First k projection rows, regrown (same seed, same leading rows) if k > MAX_K_SEM
+        if k > len(self.proj_matrix):
+            self.proj_matrix = self._build_proj_matrix(k)
+        return self.proj_matrix[:k]
 
     def project(self, token: str) -> np.ndarray:
         # Build small vector of hashed n-grams positions and project
         # For simplicity we create an r-dim vector by hashing token+nGram seeds
         vec = np.zeros(self.r, dtype=float)
-        token = token.lower()
-        # use n-grams 1..3
+        b = np.frombuffer(token.lower().encode('utf-8'), dtype=np.uint8)
+        # use byte n-grams 1..3, all n-grams of one size hashed at once (FNV-1a);
+        # the n-gram hashes extend the (n-1)-gram ones by one byte instead of rehashing
+        h = np.full(len(b), (FNV_OFFSET ^ self._seed) & 0xffffffff, dtype=np.uint32)
         for n in (1,2,3):
-            for i in range(len(token)-n+1):
-                ngram = token[i:i+n]
-                h = murmur_hash32(ngram, seed=self._seed)  # deterministic int
-                idx = h % self.r
-                vec[idx] += 1.0
+            if len(b) < n:
+                break
+            h = (h[:len(b) - n + 1] ^ b[n - 1:]) * np.uint32(FNV_PRIME)
+            # fold high bits down: FNV-1a low bits alone alias e.g. '1' and 'q'
+            vec += np.bincount((h ^ (h >> np.uint32(16))) % np.uint32(self.r), minlength=self.r)
         # Normalize
         norm = np.linalg.norm(vec)
         if norm > 0:
@@ -53,57 +157,103 @@ class SemanticProjector:
 
     def semantic_hashes(self, token: str, k: int, m: int) -> List[int]:
         # Convert projected vector into k integer indexes in [0, m-1]
+        # (reference for kernels.compute_indices, which FSBIIndex uses in bulk)
         z = self.project(token)
-        # Use random linear projections (signed) to produce bits
+        # Use random linear projections (signed) to produce bits; float32 weights,
+        # float64 accumulation so the 1e-6 quantization below is stable
+        scores = self.projection_matrix(k) @ z
         idxs = []
+        b = token.encode('utf-8')
         for j in range(k):
-            # create deterministic projection with per-j seed
-            rng = np.random.RandomState(hash((j, self._seed)) & 0xffffffff)
-            proj = rng.randn(self.r)
-            score = float(np.dot(proj, z))
             # map score to index deterministically
-            # quantize: map to 0..m-1 by hashing string(token + j + score)
-            combined = f"{token}|{j}|{round(score,6)}"
+            # quantize: hash token bytes + score rounded to 1e-6 as int64
+            combined = b + struct.pack('<q', int(np.round(float(scores[j]) * 1e6)))
             idx = murmur_hash32(combined, seed=j) % m
             idxs.append(int(idx))
         return idxs
 
 class BloomNode:
-    def __init__(self, m_bits=DEFAULT_M, level=0, name=""):
+    # Per-subsequence nodes hold only k set bits, so they are stored as roaring
+    # bitmaps (array containers while sparse); dense doc roots live in FSBIIndex.root_bits
+    def __init__(self, m_bits=DEFAULT_M, level=0, name="", idxs: Tuple[int, ...] = ()):
         self.m = m_bits
-        self.bits = bitarray(self.m)
-        self.bits.setall(0)
+        self.bits = BitMap(idxs)
         self.level = level
         self.name = name  # for debugging
         self.children = {}  # token->BloomNode or phrase->BloomNode
 
+    @property
+    def words(self) -> np.ndarray:
+        # packed uint64 copy of the bitmap
+        return index_mask(self.bits.to_array(), self.m)
+
     def insert_indexes(self, idxs: List[int]):
-        for i in idxs:
-            self.bits[i % self.m] = 1
+        self.bits.update(int(i) for i in idxs)
 
-    def noisy_bits(self, flip_prob: float = DIFF_PRIV_FLIP_PROB):
+    def noisy_words(self, flip_prob: float = DIFF_PRIV_FLIP_PROB) -> np.ndarray:
         # Return noisy copy (do not mutate original unless intended)
-        noisy = self.bits.copy()
         if flip_prob <= 0:
-            return noisy
+            return self.words.copy()
         # flip some bits
-        for i in range(self.m):
-            if random.random() < flip_prob:
-                noisy[i] = not noisy[i]
-        return noisy
+        return self.words ^ flip_mask(self.m, min(flip_prob, 1.0))
+
+    def noisy_bits(self, flip_prob: float = DIFF_PRIV_FLIP_PROB):
+        return words_to_bits(self.noisy_words(flip_prob), self.m)
+
+    def match_bitmap(self, qbits: BitMap) -> float:
+        # Fraction of the query's set bits present in this node
+        return self.bits.intersection_cardinality(qbits) / len(qbits) if len(qbits) > 0 else 0.0
 
     def match_score(self, idxs: List[int]) -> float:
-        hits = sum(1 for i in idxs if self.bits[i % self.m])
-        return hits / len(idxs) if len(idxs) > 0 else 0.0
+        return self.match_bitmap(query_mask(tuple(idxs), self.m)[3])
+
+    def encode(self) -> Dict[str, Any]:
+        # Snapshot encoding, see encode_words; sparse nodes skip the dense round trip
+        if len(self.bits) <= self.m // SPARSE_EXPORT_DIV:
+            return {"pos": list(self.bits)}
+        return encode_words(self.words, self.m)
 
 class FSBIIndex:
     def __init__(self, m_bits=DEFAULT_M, k_lex=DEFAULT_K_LEX, k_sem=DEFAULT_K_SEM):
+        # blocked layout (block_indexes) needs whole blocks, else trailing bits go unused
+        if m_bits > BLOCK_BITS and m_bits % BLOCK_BITS:
+            raise ValueError(f"m_bits must be <= {BLOCK_BITS} or a multiple of it, got {m_bits}")
         self.m = m_bits
         self.k_lex = k_lex
         self.k_sem = k_sem
         self.projector = SemanticProjector(r=DEFAULT_R)
         self.docs = {}  # doc_id -> metadata (title etc.)
-        self.trees = {}  # doc_id -> root BloomNode
+        # Doc-level root filters packed row-wise so a query scans the corpus in one op
+        self.doc_ids = []  # row -> doc_id
+        self._doc_rows = {}  # doc_id -> row
+        self._root_buf = np.zeros((16, (self.m + 63) >> 6), dtype=np.uint64)  # grown by doubling
+        self.children = []  # row -> {(level, subseq): BloomNode}
+        # subseq -> lex+sem bit indexes (LRU, at most HASH_CACHE_SIZE entries), shared by
+        # indexing and queries; common tokens and bigrams recur heavily
+        self._hash_cache = OrderedDict()
+        self._hash_lock = threading.Lock()
+
+    @property
+    def root_bits(self) -> np.ndarray:
+        # (D, nwords) uint64 view of the live root filters
+        return self._root_buf[:len(self.doc_ids)]
+
+    def _alloc_row(self, doc_id: str) -> int:
+        row = self._doc_rows.get(doc_id)
+        if row is not None:
+            # re-indexing: clear the old root and its children
+            self._root_buf[row] = 0
+            self.children[row] = {}
+            return row
+        row = len(self.doc_ids)
+        if row == len(self._root_buf):
+            grown = np.zeros((2 * len(self._root_buf), self._root_buf.shape[1]), dtype=np.uint64)
+            grown[:row] = self._root_buf
+            self._root_buf = grown
+        self.doc_ids.append(doc_id)
+        self.children.append({})
+        self._doc_rows[doc_id] = row
+        return row
 
     # Fractal decomposition: returns list of subsequences by level
     def fractal_decompose(self, text: str, max_phrase_len: int = 3) -> Dict[int, List[str]]:
@@ -112,11 +262,8 @@ class FSBIIndex:
         text = text.strip().lower()
         tokens = [t for t in text.split() if t]
         levels = {}
-        # Level 1: characters of the full text
-        levels.setdefault(1, [])
-        for ch in text:
-            if ch.strip():
-                levels[1].append(ch)
+        # Level 1: non-whitespace characters of the full text (the tokens, concatenated)
+        levels[1] = list("".join(tokens))
         # Level 2: bigrams per token
         levels.setdefault(2, [])
         for t in tokens:
@@ -132,85 +279,171 @@ class FSBIIndex:
                 levels[lvl].append(" ".join(tokens[i:i+L]))
         return levels
 
-    def _lex_hashes(self, s: str, k: int) -> List[int]:
-        # simple lexicographic hashes: murmur variations
-        return [murmur_hash32(s, seed=j) % self.m for j in range(k)]
+    def _hash_batch(self, subseqs: List[str]) -> np.ndarray:
+        # (len(subseqs), k_lex + k_sem) bit indexes from one native kernel call:
+        # lexical murmur variations followed by semantic projection hashes,
+        # mapped into the blocked Bloom layout
+        buf, offsets = pack_subseqs(subseqs)
+        # per-query misses take the serial (AOT when built) kernel, document batches the
+        # parallel one once its background compile has finished
+        parallel = len(subseqs) >= PARALLEL_HASH_MIN_SUBSEQS and jit_ready(compute_indices)
+        kernel = compute_indices if parallel else compute_indices_serial
+        rows = kernel(buf, offsets, self.k_lex, self.k_sem, self.m,
+                      self.projector._seed, self.projector.projection_matrix(self.k_sem))
+        return block_indexes(rows, self.m)
 
-    def _sem_hashes(self, s: str, k: int) -> List[int]:
-        return self.projector.semantic_hashes(s, k, self.m)
+    def _subseq_hashes_many(self, subseqs: List[str]) -> List[Tuple[int, ...]]:
+        # idxs for each subseq through the bounded LRU; all misses hashed in one kernel call
+        cache = self._hash_cache
+        with self._hash_lock:
+            found = []
+            for s in subseqs:
+                idxs = cache.get(s)
+                if idxs is not None:
+                    cache.move_to_end(s)
+                found.append(idxs)
+        missing = [s for s, idxs in zip(subseqs, found) if idxs is None]
+        if not missing:
+            return found
+        computed = dict(zip(missing, (tuple(r) for r in self._hash_batch(missing).tolist())))
+        with self._hash_lock:
+            cache.update(computed)
+            for s in computed:
+                cache.move_to_end(s)
+            while len(cache) > HASH_CACHE_SIZE:
+                cache.popitem(last=False)
+        return [computed[s] if idxs is None else idxs for s, idxs in zip(subseqs, found)]
 
     def index_document(self, doc_id: str, text: str, metadata: Dict[str, Any] = None):
-        # create root node for doc
-        root = BloomNode(m_bits=self.m, level=0, name=f"{doc_id}_root")
+        # claim the doc's root row
+        row = self._alloc_row(doc_id)
         decomposition = self.fractal_decompose(text)
+        # hash the document's uncached subsequences in a single kernel call
+        unique = list(dict.fromkeys(s for subseqs in decomposition.values() for s in subseqs))
+        idxs_of = dict(zip(unique, self._subseq_hashes_many(unique)))
+        # insert into root as doc-level summary
+        self._root_buf[row] |= index_mask([i for idxs in idxs_of.values() for i in idxs], self.m)
         # insert all subsequences at appropriate nodes: create child nodes per token/phrase
+        children = self.children[row]
         for lvl, subseqs in decomposition.items():
             for subseq in subseqs:
-                # insert into root as doc-level summary
-                lex_idxs = self._lex_hashes(subseq, self.k_lex)
-                sem_idxs = self._sem_hashes(subseq, self.k_sem)
-                root.insert_indexes(lex_idxs + sem_idxs)
-                # per-subsequence child node
-                child_name = f"l{lvl}:{subseq}"
-                if child_name not in root.children:
-                    root.children[child_name] = BloomNode(m_bits=self.m, level=lvl, name=child_name)
-                root.children[child_name].insert_indexes(lex_idxs + sem_idxs)
+                # per-subsequence child node; a repeat of the same subseq sets no new bits
+                key = (lvl, subseq)
+                if key not in children:
+                    children[key] = BloomNode(m_bits=self.m, level=lvl, name=f"l{lvl}:{subseq}",
+                                              idxs=idxs_of[subseq])
         # Save doc
         self.docs[doc_id] = {"text": text, "meta": metadata or {}}
-        self.trees[doc_id] = root
 
-    def query(self, query_text: str, top_k: int = 10, thresholds: Dict[int, float] = None) -> List[Tuple[str, float]]:
-        """
-        Query FSBI: returns ranked list of (doc_id, score).
-        thresholds: level->min_match_score to descend
-        """
-        thresholds = thresholds or {}
+    def _prepare_query(self, query_text: str):
+        # hash each query subsequence once and reuse it for every doc:
+        # (level, subseq, mask words, word positions, bit count, bitmap, level weight)
         q_decomp = self.fractal_decompose(query_text)
+        # every subsequence's idxs are needed up front for the root mask (children are only
+        # reached after the root prune), so the misses are hashed in one kernel call
+        unique = list(dict.fromkeys(s for subseqs in q_decomp.values() for s in subseqs))
+        idxs_of = dict(zip(unique, self._subseq_hashes_many(unique)))
+        q_subseq_info = []
+        qmask = np.zeros((self.m + 63) >> 6, dtype=np.uint64)
+        for lvl, subseqs in q_decomp.items():
+            for s in subseqs:
+                w, smask, total, qbits = query_mask(idxs_of[s], self.m)
+                qmask[w] |= smask
+                # weight inversely with level depth (example)
+                q_subseq_info.append((lvl, s, smask, w, total, qbits, 1.0 / (1 + lvl)))
+        # root match: all query subsequences OR-ed into one mask
+        return q_subseq_info, qmask
+
+    def _rank(self, q_subseq_info, root_scores: np.ndarray, top_k: int,
+              thresholds: Dict[int, float]) -> List[Tuple[str, float]]:
+        root_bits = self.root_bits
         candidates = []
-        for doc_id, root in self.trees.items():
-            # root match
-            root_hits = 0
-            root_total = 0
-            for lvl, subseqs in q_decomp.items():
-                for s in subseqs:
-                    ids = self._lex_hashes(s, self.k_lex) + self._sem_hashes(s, self.k_sem)
-                    root_hits += sum(1 for i in ids if root.bits[i % self.m])
-                    root_total += len(ids)
-            root_score = (root_hits / root_total) if root_total > 0 else 0.0
-            if root_score < thresholds.get(0, 0.01):
-                continue  # prune
+        # prune, then descend only on surviving docs
+        for row in np.nonzero(root_scores >= thresholds.get(0, 0.01))[0].tolist():
             # descend: compute weighted score combining matching child nodes
             score = 0.0
             total_w = 0.0
-            for lvl, subseqs in q_decomp.items():
-                for s in subseqs:
-                    child_name = f"l{lvl}:{s}"
-                    idxs = self._lex_hashes(s, self.k_lex) + self._sem_hashes(s, self.k_sem)
-                    # if child exists, use child match; else use root bits as fallback
-                    if child_name in root.children:
-                        m = root.children[child_name].match_score(idxs)
-                    else:
-                        m = root.match_score(idxs)
-                    w = 1.0 / (1 + lvl)  # weight inversely with level depth (example)
-                    score += w * m
-                    total_w += w
+            children = self.children[row]
+            for lvl, s, smask, words, total, qbits, w in q_subseq_info:
+                # if child exists, use child match; else use root bits as fallback
+                child = children.get((lvl, s))
+                if total == 0:
+                    m = 0.0
+                elif child is not None:
+                    m = child.bits.intersection_cardinality(qbits) / total
+                else:
+                    m = int(popcount_and(root_bits[row][words], smask)) / total
+                score += w * m
+                total_w += w
             final_score = score / total_w if total_w > 0 else 0.0
-            candidates.append((doc_id, float(final_score)))
+            candidates.append((self.doc_ids[row], float(final_score)))
         # sort and return top_k
         candidates.sort(key=lambda x: x[1], reverse=True)
         return candidates[:top_k]
 
+    def query(self, query_text: str, top_k: int = 10, thresholds: Dict[int, float] = None) -> List[Tuple[str, float]]:
+        """
+        Query FSBI: returns ranked list of (doc_id, score).
+        thresholds: level->min_match_score to descend
+        """
+        thresholds = thresholds or {}
+        q_subseq_info, qmask = self._prepare_query(query_text)
+        q_total = popcount(qmask)
+        if q_total == 0:
+            return []
+        # score every document's root in one AND+popcount over the packed matrix;
+        # large corpora use the threaded kernel, small ones skip its dispatch cost
+        root_bits = self.root_bits
+        if len(root_bits) >= PARALLEL_SCAN_MIN_DOCS:
+            root_hits = (scan if jit_ready(scan) else scan_serial)(root_bits, qmask)
+        else:
+            root_hits = popcount_and(root_bits, qmask)
+        return self._rank(q_subseq_info, root_hits / q_total, top_k, thresholds)
+
+    def query_batch(self, query_texts: List[str], top_k: int = 10,
+                    thresholds: Dict[int, float] = None) -> List[List[Tuple[str, float]]]:
+        """
+        Same as query() for several queries at once: the root scan reads the
+        packed doc matrix a single time and scores it against all Q query masks.
+        """
+        return self.query_prepared([self._prepare_query(q) for q in query_texts], top_k, thresholds)
+
+    def query_prepared(self, prepared: List[Tuple[list, np.ndarray]], top_k: Union[int, List[int]] = 10,
+                       thresholds: Dict[int, float] = None) -> List[List[Tuple[str, float]]]:
+        # query_batch on already-prepared queries (outputs of _prepare_query), so a
+        # caller batching independent requests can prepare and fail them one by one;
+        # top_k may be a list with each query's own cut-off
+        thresholds = thresholds or {}
+        if not prepared:
+            return []
+        top_ks = top_k if isinstance(top_k, list) else [top_k] * len(prepared)
+        qmasks = np.stack([qmask for _, qmask in prepared])
+        q_totals = popcount_and(qmasks, qmasks)
+        root_bits = self.root_bits
+        if len(root_bits) >= PARALLEL_SCAN_MIN_DOCS:
+            root_hits = (scan_batch if jit_ready(scan_batch) else scan_batch_serial)(root_bits, qmasks)
+        else:
+            # one (D, nwords) pass per query: no (D, Q, nwords) temporary
+            root_hits = np.stack([popcount_and(root_bits, qmask) for qmask in qmasks], axis=1)
+        results = []
+        for j, (q_subseq_info, _) in enumerate(prepared):
+            if q_totals[j] == 0:
+                results.append([])
+                continue
+            results.append(self._rank(q_subseq_info, root_hits[:, j] / q_totals[j], top_ks[j], thresholds))
+        return results
+
     def get_doc(self, doc_id: str) -> Dict[str, Any]:
         return self.docs.get(doc_id, {})
 
     def export_index_snapshot(self) -> Dict[str, Any]:
-        # Export only bitarrays as lists of ints (compressed approach possible)
+        # Export bit buffers as {"b64": packed words} or {"pos": [set bits]} (see encode_words)
         out = {}
-        for doc_id, root in self.trees.items():
-            out_doc = {
-                "root_bits": root.bits.to01(),
-                "children": {k: v.bits.to01() for k, v in root.children.items()},
+        for row, doc_id in enumerate(self.doc_ids):
+            out[doc_id] = {
+                "root_bits": encode_words(self.root_bits[row], self.m),
+                "children": {f"l{lvl}:{subseq}": child.encode()
+                             for (lvl, subseq), child in self.children[row].items()},
                 "meta": self.docs[doc_id]["meta"]
             }
-            out[doc_id] = out_doc
         return out
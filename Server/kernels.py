@@ -0,0 +1,172 @@
+# kernels.py
+import threading
+import warnings
+import numpy as np
+from numba import get_num_threads, njit, prange, typeof
+from typing import List, Tuple
+
+KERNEL_VERSION = 2  # bump whenever a kernel's output or signature changes; stale AOT builds are ignored
+M32 = 0xFFFFFFFF
+FNV_OFFSET = 2166136261
+FNV_PRIME = 16777619
+
+@njit(cache=True)
+def murmur3_32(data, start, end, seed):
+    # MurmurHash3 x86_32 over data[start:end]; matches mmh3.hash(bytes, seed, signed=False)
+    h = np.int64(seed) & M32
+    n = end - start
+    nblocks = n // 4
+    for i in range(nblocks):
+        p = start + 4 * i
+        k = (np.int64(data[p]) | (np.int64(data[p + 1]) << 8)
+             | (np.int64(data[p + 2]) << 16) | (np.int64(data[p + 3]) << 24))
+        k = (k * 0xcc9e2d51) & M32
+        k = ((k << 15) | (k >> 17)) & M32
+        k = (k * 0x1b873593) & M32
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & M32
+        h = (h * 5 + 0xe6546b64) & M32
+    tail = start + nblocks * 4
+    rem = n & 3
+    k = np.int64(0)
+    if rem == 3:
+        k ^= np.int64(data[tail + 2]) << 16
+    if rem >= 2:
+        k ^= np.int64(data[tail + 1]) << 8
+    if rem >= 1:
+        k ^= np.int64(data[tail])
+        k = (k * 0xcc9e2d51) & M32
+        k = ((k << 15) | (k >> 17)) & M32
+        k = (k * 0x1b873593) & M32
+        h ^= k
+    h ^= n
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & M32
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & M32
+    h ^= h >> 16
+    return h
+
+@njit(cache=True)
+def project(data, start, end, seed, r):
+    # Same byte n-gram FNV-1a bucketing as SemanticProjector.project (input already lowercased)
+    vec = np.zeros(r, dtype=np.float64)
+    offset = (np.int64(FNV_OFFSET) ^ seed) & M32
+    for i in range(start, end):
+        # the (n+1)-gram hash at i extends the n-gram hash by one byte
+        h = offset
+        for n in range(min(3, end - i)):
+            h = ((h ^ data[i + n]) * FNV_PRIME) & M32
+            vec[(h ^ (h >> 16)) % r] += 1.0
+    norm = np.sqrt(np.sum(vec * vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+@njit(parallel=True, cache=True)
+def compute_indices(buf, offsets, k_lex, k_sem, m, seed, projections):
+    """
+    Bit indexes for every subsequence buf[offsets[t]:offsets[t+1]].
+    Row t holds k_lex lexical hashes followed by k_sem semantic hashes, all in [0, m).
+    """
+    n = len(offsets) - 1
+    out = np.empty((n, k_lex + k_sem), dtype=np.int64)
+    r = projections.shape[1]
+    for t in prange(n):
+        s = offsets[t]
+        e = offsets[t + 1]
+        for j in range(k_lex):
+            out[t, j] = murmur3_32(buf, s, e, j) % m
+        if k_sem > 0:
+            z = project(buf, s, e, seed, r)
+            # semantic key: token bytes + quantized score as little-endian int64
+            key = np.empty(e - s + 8, dtype=np.uint8)
+            key[:e - s] = buf[s:e]
+            for j in range(k_sem):
+                score = 0.0
+                for i in range(r):
+                    score += projections[j, i] * z[i]
+                q = np.int64(np.round(score * 1e6))
+                for b in range(8):
+                    key[e - s + b] = (q >> (8 * b)) & 0xff
+                out[t, k_lex + j] = murmur3_32(key, 0, len(key), j) % m
+    return out
+
+@njit(inline='always')
+def popcount64(x):
+    # SWAR popcount; LLVM lowers this pattern to a single POPCNT
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return np.int64((x * np.uint64(0x0101010101010101)) >> np.uint64(56))
+
+@njit(parallel=True, cache=True)
+def scan(root_bits, qmask):
+    # popcount(root_bits[d] & qmask) for every row, rows split across threads (GIL released)
+    d, nwords = root_bits.shape
+    out = np.empty(d, dtype=np.int64)
+    for i in prange(d):
+        hits = 0
+        for w in range(nwords):
+            hits += popcount64(root_bits[i, w] & qmask[w])
+        out[i] = hits
+    return out
+
+@njit(parallel=True, cache=True)
+def scan_batch(root_bits, qmasks):
+    # (D, Q) hits for Q query masks; each root row is loaded once and scored against all of them
+    d, nwords = root_bits.shape
+    nq = qmasks.shape[0]
+    out = np.empty((d, nq), dtype=np.int64)
+    for i in prange(d):
+        for q in range(nq):
+            hits = 0
+            for w in range(nwords):
+                hits += popcount64(root_bits[i, w] & qmasks[q, w])
+            out[i, q] = hits
+    return out
+
+def pack_subseqs(subseqs: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # Concatenate utf-8 encoded subsequences into one byte buffer plus offsets
+    encoded = [s.encode('utf-8') for s in subseqs]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    buf = np.frombuffer(bytearray(b"".join(encoded)), dtype=np.uint8)
+    return buf, offsets
+
+# Ahead-of-time build from build_kernels.py: native code with no JIT warm-up. pycc compiles
+# prange as a plain range, so these serial kernels serve every call until the parallel JIT
+# kernels have compiled, and small per-query batches after that. Builds from another
+# KERNEL_VERSION are skipped.
+compute_indices_serial = compute_indices
+scan_serial = scan
+scan_batch_serial = scan_batch
+try:
+    import fsbi_kernels
+    if fsbi_kernels.kernel_version() == KERNEL_VERSION:
+        compute_indices_serial = fsbi_kernels.compute_indices
+        scan_serial = fsbi_kernels.scan
+        scan_batch_serial = fsbi_kernels.scan_batch
+    else:
+        warnings.warn("ignoring stale fsbi_kernels build; rerun build_kernels.py")
+except ImportError:
+    pass
+
+def jit_ready(kernel) -> bool:
+    # a dispatcher lists a signature once it has compiled (or loaded it from the numba cache)
+    return bool(kernel.signatures)
+
+def _warm_up():
+    # compile (without running) the parallel kernels for the argument types fsbi passes,
+    # so the first document or large query does not pay the JIT cost on the request path
+    buf, offsets = pack_subseqs(["a"])
+    proj = np.zeros((1, 1), dtype=np.float32)
+    compute_indices.compile((typeof(buf), typeof(offsets)) + (typeof(0),) * 4 + (typeof(proj),))
+    rows = np.zeros((1, 1), dtype=np.uint64)
+    scan.compile((typeof(rows), typeof(rows[0])))
+    scan_batch.compile((typeof(rows), typeof(rows)))
+
+# start numba's thread pool from the main thread: a TBB pool first launched from a worker
+# thread (the warm-up, or the query batcher) hangs interpreter exit
+get_num_threads()
+threading.Thread(target=_warm_up, name="fsbi-jit-warmup", daemon=True).start()
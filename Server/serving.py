@@ -0,0 +1,114 @@
+# serving.py
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+QUERY_BATCH_MAX = 32  # most queries scored in one root-matrix scan
+QUERY_BATCH_WINDOW = 0.002  # seconds to wait for more queries after the first
+
+class RWLock:
+    """
+    Many concurrent readers (queries, snapshots) or one writer (indexing).
+    Writers get priority so a steady query stream cannot starve indexing.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+    def read(self):
+        return _Guard(self.acquire_read, self.release_read)
+
+    def write(self):
+        return _Guard(self.acquire_write, self.release_write)
+
+class _Guard:
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc):
+        self._release()
+
+class QueryBatcher:
+    """
+    Collects queries arriving within QUERY_BATCH_WINDOW of each other and runs
+    them through FSBIIndex.query_batch, so concurrent requests share one scan
+    of the document matrix.
+    """
+    def __init__(self, index, lock: RWLock, max_batch: int = QUERY_BATCH_MAX,
+                 window: float = QUERY_BATCH_WINDOW):
+        self.index = index
+        self.lock = lock
+        self.max_batch = max_batch
+        self.window = window
+        self._pending = queue.Queue()
+        threading.Thread(target=self._run, name="fsbi-query-batcher", daemon=True).start()
+
+    def submit(self, query_text: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        fut = Future()
+        self._pending.put((query_text, top_k, fut))
+        return fut.result()
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            with self.lock.read():
+                # prepare one by one so a bad query only fails its own request
+                ok = []
+                for q, top_k, fut in batch:
+                    try:
+                        ok.append((self.index._prepare_query(q), top_k, fut))
+                    except Exception as e:
+                        fut.set_exception(e)
+                if not ok:
+                    continue
+                try:
+                    results = self.index.query_prepared([p for p, _, _ in ok],
+                                                        top_k=[k for _, k, _ in ok])
+                except Exception as e:
+                    for _, _, fut in ok:
+                        fut.set_exception(e)
+                    continue
+            for (_, _, fut), res in zip(ok, results):
+                fut.set_result(res)
@@ -0,0 +1,37 @@
+# test_kernels.py
+# Parity between the numba kernels and the Python/mmh3 implementations they mirror.
+import mmh3
+import numpy as np
+import pytest
+
+import kernels
+from fsbi import SemanticProjector, murmur_hash32
+
+SAMPLES = ["a", "é", "hi", "iot", "i18n", "internationalization", "naïve café", "über 東京", "the quick fox"]
+
+@pytest.mark.parametrize("s", [""] + SAMPLES)
+@pytest.mark.parametrize("seed", [0, 1, 42])
+def test_murmur3_matches_mmh3(s, seed):
+    b = s.encode("utf-8")
+    buf = np.frombuffer(b, dtype=np.uint8)
+    assert kernels.murmur3_32(buf, 0, len(b), seed) == mmh3.hash(b, seed, signed=False)
+    assert kernels.murmur3_32(buf, 0, len(b), seed) == murmur_hash32(s, seed)
+
+@pytest.mark.parametrize("s", SAMPLES)
+def test_project_matches_semantic_projector(s):
+    proj = SemanticProjector()
+    buf, offsets = kernels.pack_subseqs([s])
+    got = kernels.project(buf, offsets[0], offsets[1], proj._seed, proj.r)
+    np.testing.assert_allclose(got, proj.project(s), rtol=0, atol=1e-12)
+
+@pytest.mark.parametrize("parallel", [True, False])
+def test_compute_indices_matches_reference(parallel):
+    proj = SemanticProjector()
+    m, k_lex, k_sem = 2048, 2, 3
+    kernel = kernels.compute_indices if parallel else kernels.compute_indices_serial
+    buf, offsets = kernels.pack_subseqs(SAMPLES)
+    rows = kernel(buf, offsets, k_lex, k_sem, m, proj._seed, proj.projection_matrix(k_sem))
+    for s, row in zip(SAMPLES, rows.tolist()):
+        expected = [murmur_hash32(s, seed=j) % m for j in range(k_lex)]
+        expected += proj.semantic_hashes(s, k_sem, m)
+        assert row == expected, s
@@ -0,0 +1,81 @@
+# test_serving.py
+# Batched querying and the locking/batching layer app.py serves it through.
+import threading
+import time
+
+import pytest
+
+import fsbi
+from fsbi import FSBIIndex
+from serving import QueryBatcher, RWLock
+
+DOCS = ["fast bloom filter search", "fractal semantic index", "bloom filters for text",
+        "semantic search over documents", "privacy noise on bit vectors", "quick brown fox"]
+QUERIES = ["bloom search", "semantic index", "fox", "nothing matches here", ""]
+
+@pytest.fixture
+def index():
+    idx = FSBIIndex()
+    for i, text in enumerate(DOCS):
+        idx.index_document(f"d{i}", text)
+    return idx
+
+@pytest.mark.parametrize("min_docs", [1, 10 ** 9])
+def test_query_batch_matches_query(index, monkeypatch, min_docs):
+    # both sides of PARALLEL_SCAN_MIN_DOCS: scan kernels and numpy popcount
+    monkeypatch.setattr(fsbi, "PARALLEL_SCAN_MIN_DOCS", min_docs)
+    for top_k in (3, 10, -1):
+        assert index.query_batch(QUERIES, top_k=top_k) == [index.query(q, top_k=top_k) for q in QUERIES]
+
+def test_query_prepared_per_query_top_k(index):
+    prepared = [index._prepare_query(q) for q in QUERIES]
+    top_ks = [1, 10, -1, 2, 5]
+    assert index.query_prepared(prepared, top_k=top_ks) == [index.query(q, top_k=k) for q, k in zip(QUERIES, top_ks)]
+
+def test_batcher_failure_only_fails_its_own_query(index):
+    # a wide window puts all three requests in one batch
+    batcher = QueryBatcher(index, RWLock(), window=0.5)
+    results = {}
+
+    def submit(name, q, top_k):
+        try:
+            results[name] = batcher.submit(q, top_k=top_k)
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=submit, args=args)
+               for args in (("bad", 123, 10), ("small", "bloom search", 1), ("large", "bloom search", 10))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert isinstance(results["bad"], Exception)
+    assert results["small"] == index.query("bloom search", top_k=1)
+    assert results["large"] == index.query("bloom search", top_k=10)
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    events = []
+    lock.acquire_read()
+
+    def writer():
+        with lock.write():
+            events.append("write")
+
+    def reader():
+        with lock.read():
+            events.append("read")
+
+    w = threading.Thread(target=writer)
+    w.start()
+    # wait until the writer is queued behind the first reader
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+    r = threading.Thread(target=reader)
+    r.start()
+    r.join(timeout=0.2)
+    assert r.is_alive() and events == []
+    lock.release_read()
+    w.join(timeout=5)
+    r.join(timeout=5)
+    assert events == ["write", "read"]